@@ -5,8 +5,21 @@ Version = "2.0"
 
 import sys
 import csv
-import ctypes
+import argparse
+import datetime
 import os	# for getsize
+import io
+import time
+import contextlib
+import concurrent.futures
+import threading
+import queue
+import zlib
+import lzma
+import json
+import mmap
+from array import array
+from functools import cached_property
 
 # Input files
 DATA_FILE = 'SIGHTING.DAT'
@@ -19,6 +32,8 @@ ASSOCIATE_FILE = 'ASSOCIAT.AVI'
 # Output files
 EXPORT_FILE = 'AviSys.sightings.'
 NOTE_OUTPUT = 'FieldNotes.txt'
+REPORT_FILE = 'AviSys.lists.'
+ERROR_FILE = 'AviSys.errors.txt'
 
 stateCode = {
 'Alabama':'AL',
@@ -112,11 +127,10 @@ class NoteBlock:
 # E.g., first block contains 3 records of 125 bytes, plus the first 123 bytes of the 4th record.
 # Each data line is prefixed with its length in the first byte
 
-	def __init__(self,file,blockNumber):	# Read the specified block from FNotes.DAT
-		self.file = file
+	def __init__(self,notes,blockNumber):	# Locate the specified block in the mapped FNotes.DAT
+		self.notes = notes
 		offset = blockNumber * 512
-		file.seek(offset)
-		block = file.read(512)
+		block = notes[offset:offset+512]
 		validBytes = int.from_bytes(block[506:508],'little')
 		self.next = int.from_bytes(block[508:512],'little')
 		if block[0] == 0:
@@ -126,23 +140,62 @@ class NoteBlock:
 
 	def extract(self):	#	Extract the chain of blocks, and the individual records from the chain
 		data = self.extractBlocks()
-		output = ''
+		lines = []
 		ptr = 0
 		while ptr < len(data):
 			strlen = data[ptr]	# First byte has the length
 			ptr += 1	# String starts in second byte
-			output += data[ptr:ptr+strlen].decode('Windows-1252') + '\n'
+			lines.append(data[ptr:ptr+strlen])
 			ptr += 124
-		return output
+		if not lines:
+			return ''
+		return b'\n'.join(lines).decode('Windows-1252') + '\n'	# Decode the whole note at once
 
 	def extractBlocks(self):	# Extract data from this block and blocks chained to it
-		data = self.data
-		if self.next:
-			block = NoteBlock(self.file,self.next)
-			data += block.extractBlocks()
-		return data
-
-def readMaster():
+#	A chain that leads back to a block already read, or out of the file, is broken; ValueError is raised.
+		pieces = [self.data]
+		block = self
+		numBlocks = len(self.notes) // 512
+		seen = set()
+		while block.next:
+			if block.next in seen or block.next >= numBlocks:
+				raise ValueError('The chain of blocks in ' + NOTE_FILE + ' is broken at block ' + str(block.next))
+			seen.add(block.next)
+			block = NoteBlock(self.notes,block.next)
+			pieces.append(block.data)
+		return b''.join(pieces)
+
+def mapFile(file):	# Map an open input file into memory, so records can be sliced from it without copying
+	if os.fstat(file.fileno()).st_size == 0:
+		return memoryview(b'')	# An empty file cannot be mapped
+	return memoryview(mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ))
+
+def decodeName(raw,decodedNames):
+#	Decode a name from one of the AviSys files.
+#	Each distinct name is decoded only once per database (decodedNames, kept by the Export), and every use of it shares the same str.
+	text = decodedNames.get(raw)
+	if text is None:
+		raw = bytes(raw)
+		text = decodedNames[raw] = raw.decode('Windows-1252')
+	return text
+
+class NameTable:
+#	Names kept as slices of a mapped file, decoded the first time they are looked up
+	def __init__(self,decodedNames):
+		self.raw = {}
+		self.decoded = {}
+		self.decodedNames = decodedNames
+	def __setitem__(self,key,raw):
+		self.raw[key] = raw
+	def __contains__(self,key):
+		return key in self.raw
+	def __getitem__(self,key):
+		text = self.decoded.get(key)
+		if text is None:
+			text = self.decoded[key] = decodeName(self.raw[key],self.decodedNames)
+		return text
+
+def readMaster(dataDir,decodedNames):
 #	Fill in the species name lookup table
 #	MASTER.AVI contains the taxonomy in 110 byte records
 
@@ -179,40 +232,42 @@ def readMaster():
 # 2a 0200 0000  NC species that I have seen but not in NC
 # 2a 0200 0200  NC species seen in NC
 
-	name = {}
-	genusName = {}
-	speciesName = {}
+	name = NameTable(decodedNames)
+	genusName = NameTable(decodedNames)
+	speciesName = NameTable(decodedNames)
+	masterFile = os.path.join(dataDir,MASTER_FILE)
 	try:
-		master_input = open(MASTER_FILE, "rb")
+		master_input = open(masterFile, "rb")
 	except FileNotFoundError:
-		print('Error: File',MASTER_FILE,'not found.')
+		print('Error: File',masterFile,'not found.')
 		raise SystemExit
 	except:
-		print("Error opening",MASTER_FILE,'--',sys.exc_info()[1])
+		print("Error opening",masterFile,'--',sys.exc_info()[1])
 		raise SystemExit
 
-	while True:
-		taxon = master_input.read(110)	# Read a record of 110 bytes
-		if not taxon:
-			break
+	master = mapFile(master_input)
+	master_input.close()
+
+	for offset in range(0,len(master),110):
+		taxon = master[offset:offset+110]	# A record of 110 bytes
 		speciesNo = int.from_bytes(taxon[5:7],"little")
-		name[speciesNo] = taxon[8:(8+taxon[7])].decode('Windows-1252')
-		genusName[speciesNo] = taxon[53:(53+taxon[52])].decode('Windows-1252')
-		speciesName[speciesNo] = taxon[78:(78+taxon[77])].decode('Windows-1252')
+		name[speciesNo] = taxon[8:(8+taxon[7])]
+		genusName[speciesNo] = taxon[53:(53+taxon[52])]
+		speciesName[speciesNo] = taxon[78:(78+taxon[77])]
 
-	master_input.close()
 	return (name,genusName,speciesName)
 
 class FileSpecs:
-	def __init__(self):
-		
+	def __init__(self,dataDir):
+		dataFile = os.path.join(dataDir,DATA_FILE)
+		placesFile = os.path.join(dataDir,PLACES_FILE)
 		try:
-			sighting_file = open(DATA_FILE,"rb")
+			sighting_file = open(dataFile,"rb")
 		except FileNotFoundError:
-			print('Error: File',DATA_FILE,'not found.')
+			print('Error: File',dataFile,'not found.')
 			raise SystemExit
 		except:
-			print("Error opening",DATA_FILE,'--',sys.exc_info()[1])
+			print("Error opening",dataFile,'--',sys.exc_info()[1])
 			raise SystemExit
 
 		header = sighting_file.read(14)
@@ -221,16 +276,16 @@ class FileSpecs:
 			AviSysVersion = 6
 		elif reclen == 76:
 			# Version 4 and 5 have same structure for SIGHTING.DAT but different sizes for PLACES.AVI		
-			placesSize = os.path.getsize(PLACES_FILE)
+			placesSize = os.path.getsize(placesFile)
 			if placesSize == 11340:
 				AviSysVersion = 4
 			elif placesSize == 63450:
 				AviSysVersion = 5
 			else:
-				print(PLACES_FILE, 'contains', placesSize, 'bytes, which is not expected for any supported AviSys version')
+				print(placesFile, 'contains', placesSize, 'bytes, which is not expected for any supported AviSys version')
 				raise SystemExit
 		else:
-			print(DATA_FILE, 'record length is', reclen, '; not a supported AviSys version')
+			print(dataFile, 'record length is', reclen, '; not a supported AviSys version')
 			raise SystemExit
 
 		sighting_file.close()
@@ -262,15 +317,35 @@ class FileSpecs:
 
 
 class Place:
-	def __init__(self,placeNumber,name,link,filespecs):
+	def __init__(self,placeNumber,rawName,link,filespecs,places,decodedNames):
 		self.placeNumber = placeNumber
-		self.name = name
+		self.rawName = rawName
+		self.decodedNames = decodedNames
 		self.link = link
 		self.table = (placeNumber-1)//(filespecs.placeDivisor)
+		self.places = places	# All the places, to follow the links
+	@property
+	def name(self):
+		return decodeName(self.rawName,self.decodedNames)
+	@cached_property
+	def linklist(self):	# The 6-level list of links for this place, made when first needed
+		links = []
+		place = self
+		for i in range(6):
+			if i == place.table:	# i is the entry for this place
+				links.append(place.name)
+				if place.link == 0:	# An unlinked place ends the list; otherwise pad it out to 6 levels
+					if place is not self:
+						links.extend([''] * (5-i))
+					break
+				place = self.places[place.link]	# now list the higher-level places this one is linked to
+			else:
+				links.append('')	#	Links are null until we get to the first one
+		return links
 	def __str__(self):
 		return str(self.placeNumber) + ': ' + self.name + ' ' + str(self.link) + ' (table ' + str(self.table) + ')'
 
-def readPlaces():
+def readPlaces(dataDir,filespecs,decodedNames):
 #	The places file (PLACES.AVI) contains fixed length records of 39 bytes
 #	Bytes
 #	0-1		Place number
@@ -278,65 +353,63 @@ def readPlaces():
 #	7-36	Place name
 #	37-38	Place number of linked location
 
-	global filespecs
-
 	output = {}
 
+	placesFile = os.path.join(dataDir,PLACES_FILE)
 	try:
-		places_input = open(PLACES_FILE,"rb")
+		places_input = open(placesFile,"rb")
 	except FileNotFoundError:
-		print('Error: File',PLACES_FILE,'not found.')
+		print('Error: File',placesFile,'not found.')
 		raise SystemExit
 	except:
-		print("Error opening",PLACES_FILE,'--',sys.exc_info()[1])
+		print("Error opening",placesFile,'--',sys.exc_info()[1])
 		raise SystemExit
 
-	while True:	#	Read all the places in the file
-		place = places_input.read(filespecs.placesRecl)	# Read a record of 39 bytes
-		if not place:
-			break
+	placesData = mapFile(places_input)
+	places_input.close()
+
+	for offset in range(0,len(placesData),filespecs.placesRecl):	#	Read all the places in the file
+		place = placesData[offset:offset+filespecs.placesRecl]	# A record of 39 bytes
 		placeNumber = int.from_bytes(place[0:2],"little")
 		if placeNumber == 0:
 			continue;
 
-		name = place[7:(7+place[6])].decode('Windows-1252')
+		name = place[7:(7+place[6])]
 		link = int.from_bytes(place[filespecs.placeLink:filespecs.placeLink+2],"little")
-		placeInfo = Place(placeNumber,name,link,filespecs)
+		placeInfo = Place(placeNumber,name,link,filespecs,output,decodedNames)
 		output[placeNumber] = placeInfo
 
-	places_input.close()
-	# Now make the 6-level list of links for each place
-	for placeNumber in output:
-		place = output[placeNumber]
-		links = []
-		for i in range(6):
-			if i == place.table:	# i is the entry for this place
-				links.append(place.name)
-				next = place.link	# now list the higher-level places this one is linked to
-				if next == 0:
-					while table < 5:
-						table += 1
-						links.append('')
-					break
-				place = output[next]
-				table = place.table
-			else:
-				links.append('')	#	Links are null until we get to the first one
-		output[placeNumber].linklist = links
 	return output
 
 
 class Association:
-	def __init__(self,placeName,locationName,lat,lng,state,nation):
-		self.placeName = placeName
-		self.locationName = locationName
-		self.lat = lat
-		self.lng = lng
-		self.state = state
-		self.nation = nation
-
-
-def readAssociate():
+#	The fields are decoded from the ASSOCIAT.AVI record only when used
+	def __init__(self,record,decodedNames):
+		self.record = record
+		self.decodedNames = decodedNames
+	def field(self,lenIndex):
+		return decodeName(self.record[lenIndex+1:lenIndex+1+self.record[lenIndex]],self.decodedNames)
+	@property
+	def placeName(self):
+		return self.field(0)
+	@property
+	def locationName(self):
+		return self.field(42)
+	@property
+	def lat(self):
+		return self.field(103)
+	@property
+	def lng(self):
+		return self.field(124)
+	@property
+	def state(self):
+		return self.field(145)
+	@property
+	def nation(self):
+		return self.field(149)
+
+
+def readAssociate(dataDir,decodedNames):
 #	The hotspot association file (ASSOCIAT.AVI) contains fixed length records of 152 bytes
 #	Bytes
 # 0			Place len
@@ -360,38 +433,32 @@ def readAssociate():
 
 	output = {}
 
+	associateFile = os.path.join(dataDir,ASSOCIATE_FILE)
 	try:
-		associate_input = open(ASSOCIATE_FILE,"rb")
+		associate_input = open(associateFile,"rb")
 	except FileNotFoundError:
-#		print('Note: File',ASSOCIATE_FILE,'not found.')
+#		print('Note: File',associateFile,'not found.')
 		return output
 	except:
-		print("Error opening",ASSOCIATE_FILE,'--',sys.exc_info()[1])
+		print("Error opening",associateFile,'--',sys.exc_info()[1])
 		raise SystemExit
 
 
-	while True:	#	Read all the places in the file
-		association = associate_input.read(152)	# Read a record of 152 bytes
-		if not association:
-			break
+	associations = mapFile(associate_input)
+	associate_input.close()
+
+	for offset in range(0,len(associations),152):	#	Read all the places in the file
+		association = associations[offset:offset+152]	# A record of 152 bytes
 		if len(association) != 152:
 			print("Odd, length is",len(association))
 		else:
-			place =	association[1:1+association[0]].decode('Windows-1252')
-			location = association[43:43+association[42]].decode('Windows-1252')
-			lat = association[104:104+association[103]].decode('Windows-1252')
-			lng = association[125:125+association[124]].decode('Windows-1252')
-			state = association[146:146+association[145]].decode('Windows-1252')
-			nation = association[150:150+association[149]].decode('Windows-1252')
-
-			Info = Association(place,location,lat,lng,state,nation)
-			output[place] = Info
+			Info = Association(association,decodedNames)
+			output[Info.placeName] = Info
 
-	associate_input.close()
 	return output
 
 
-def readNoteIndex():
+def readNoteIndex(dataDir):
 #	FNotes.IX contains fixed-length blocks.
 #	The first block begins with a 32 byte descriptive header:
 #	Bytes 0-3 contain 0xffffffff
@@ -414,18 +481,20 @@ def readNoteIndex():
 #	Valid index entries are grouped at the beginning of a block,
 #	and the block may be padded out with non-valid, i.e., unused, entries.
 
+	indexFile = os.path.join(dataDir,NOTE_INDEX)
 	try:
-		note_index = open(NOTE_INDEX,"rb")
+		note_index = open(indexFile,"rb")
 	except FileNotFoundError:
-		print('Error: File',NOTE_INDEX,'not found.')
+		print('Error: File',indexFile,'not found.')
+		raise SystemExit
 	except:
-		print("Error opening",NOTE_INDEX,'--',sys.exc_info()[1])
+		print("Error opening",indexFile,'--',sys.exc_info()[1])
 		raise SystemExit
 
 	header = note_index.read(32)
 	marker = int.from_bytes(header[0:4],'little')
 	if marker != 4294967295:
-		print('Unexpected value',marker,'at beginning of',NOTE_INDEX)
+		print('Unexpected value',marker,'at beginning of',indexFile)
 #		raise SystemExit
 	numBlocks		= int.from_bytes(header[8:12],'little')		# number of 874 byte blocks (e.g., 11)
 	blockSize		= int.from_bytes(header[12:16],'little')	# blocksize (874, 0x036a)
@@ -511,60 +580,432 @@ def integrateNote(comment,fieldnoteText):
 	return comment
 
 
-#########################################################################################################
-######################################## The program starts here ########################################
-#########################################################################################################
-print('SightingsTOcsv version ' + Version)
-outArray = []
-noteDict = {}
-# ref https://stackoverflow.com/questions/55172090/detect-if-python-program-is-executed-via-windows-gui-double-click-vs-command-p
-kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
-process_array = (ctypes.c_uint * 1)()
-num_processes = kernel32.GetConsoleProcessList(process_array, 1)
-
-if len(sys.argv) < 2:	# If no command-line argument
-	if num_processes <= 2:	# Run from double-click
-		outputType = 'eBird'
-	else:					# Run from command line
-		outputType = 'AviSys'
-else:
-	outputType = sys.argv[1]
-
-if outputType.lower() == 'avisys':
-	outputType = 'AviSys'
-elif outputType.lower() == 'ebird':
-	outputType = 'eBird'
-elif outputType.lower() == 'myebird':
-	outputType = 'MyEBirdData'
-else:
-	print("Please specify either AviSys, eBird, or MyEBird")
-	raise SystemExit
-
-filespecs = FileSpecs()
-
-try:
-	FNotes = open(NOTE_FILE,"rb")
-except FileNotFoundError:
-	print('Error: File',NOTE_FILE,'not found.')
-	raise SystemExit
-except:
-	print("Error opening",NOTE_FILE,'--',sys.exc_info()[1])
-	raise SystemExit
-
-noteIndex = readNoteIndex()
-(name,genusName,speciesName) = readMaster()
-places = readPlaces()
-
-association = readAssociate()
-
-try:
-	sighting_file = open(DATA_FILE,"rb")
-except FileNotFoundError:
-	print('Error: File',DATA_FILE,'not found.')
-	raise SystemExit
-except:
-	print("Error opening",DATA_FILE,'--',sys.exc_info()[1])
-	raise SystemExit
+class ListReport:
+#	Life, year, state and county lists, with the first and last date each species was seen,
+#	accumulated while SIGHTING.DAT is decoded, so that no second pass over the sightings is needed.
+#	Each region (the life list, one year, one state, one county) is given a small integer id.
+#	Each (region, species) pair is given a slot in parallel arrays that hold
+#	the first and last dates seen, as raw AviSys date integers, and the number of sightings.
+
+	listTypes = ['Life','Year','State','County']
+
+	def __init__(self,names):	# names: the common, genus and species name tables from readMaster
+		(self.name,self.genusName,self.speciesName) = names
+		self.regions = []		# (list type, region name), indexed by region id
+		self.regionIds = {}		# (list type, region name) -> region id
+		self.slots = {}			# region id << 16 | species number -> slot in the arrays below
+		self.firstSeen = array('L')
+		self.lastSeen = array('L')
+		self.sightings = array('L')
+		self.lifeId = self.regionId('Life','')
+
+	def regionId(self,listType,region):
+		key = (listType,region)
+		regionNo = self.regionIds.get(key)
+		if regionNo is None:
+			regionNo = len(self.regions)
+			self.regions.append(key)
+			self.regionIds[key] = regionNo
+		return regionNo
+
+	def add(self,regionId,speciesNo,date):
+		key = regionId << 16 | speciesNo
+		slot = self.slots.get(key)
+		if slot is None:
+			self.slots[key] = len(self.sightings)
+			self.firstSeen.append(date)
+			self.lastSeen.append(date)
+			self.sightings.append(1)
+		else:
+			if date < self.firstSeen[slot]:
+				self.firstSeen[slot] = date
+			if date > self.lastSeen[slot]:
+				self.lastSeen[slot] = date
+			self.sightings[slot] += 1
+
+	def record(self,speciesNo,date,country,state,county):	# date is the raw date from bytes 10-13 of the sighting
+		self.add(self.lifeId,speciesNo,date)
+		self.add(self.regionId('Year',str(date // 10000 + 1930)),speciesNo,date)
+		if state:
+			state = country + '-' + state
+			self.add(self.regionId('State',state),speciesNo,date)
+			if county:
+				self.add(self.regionId('County',county + ', ' + state),speciesNo,date)
+
+	def rows(self):	# Yield the list entries ordered by list type, region, and taxonomic order
+		order = sorted(self.slots, key=lambda key: (self.listTypes.index(self.regions[key >> 16][0]), self.regions[key >> 16][1], key & 0xffff))
+		for key in order:
+			slot = self.slots[key]
+			(listType,region) = self.regions[key >> 16]
+			yield (listType,region,key & 0xffff,formatDate(self.firstSeen[slot]),formatDate(self.lastSeen[slot]),self.sightings[slot])
+
+	def writeCSV(self,output):
+		(name,genusName,speciesName) = (self.name,self.genusName,self.speciesName)
+		writer = csv.writer(output)
+		writer.writerow(['List','Region','Common name','Genus','Species','SpeciesNo','First seen','Last seen','Sightings'])
+		for (listType,region,speciesNo,first,last,sightings) in self.rows():
+			writer.writerow([listType,region,name[speciesNo],genusName[speciesNo],speciesName[speciesNo],speciesNo,first,last,sightings])
+
+	def writeJSON(self,output):
+		(name,genusName,speciesName) = (self.name,self.genusName,self.speciesName)
+		lists = {}
+		for (listType,region,speciesNo,first,last,sightings) in self.rows():
+			lists.setdefault(listType,{}).setdefault(region,[]).append({'Common name':name[speciesNo],
+				'Scientific name':genusName[speciesNo]+' '+speciesName[speciesNo],'SpeciesNo':speciesNo,
+				'First seen':first,'Last seen':last,'Sightings':sightings})
+		json.dump(lists,output,indent=1,ensure_ascii=False)
+
+class OutputSink(io.RawIOBase):
+#	Where an output file's bytes go: a file or standard output, optionally compressed.
+#	Compression runs in a background thread. The rows are written after the sightings have been read and sorted,
+#	so it overlaps with decoding the comments and field notes and formatting the CSV.
+#	When closed, a compressed sink reports its compression ratio and throughput.
+
+	suffixes = {'gzip':'.gz','xz':'.xz','zstd':'.zst'}
+
+	def __init__(self,target,name,compressor=None,ownTarget=True):	# compressor: from newCompressor
+		self.target = target
+		self.name = name
+		self.ownTarget = ownTarget	# Standard output is flushed but not closed
+		self.compressor = compressor
+		self.rawBytes = 0
+		self.compressedBytes = 0
+		self.compressTime = 0.0
+		self.error = None
+		if self.compressor:
+			self.chunks = queue.Queue(maxsize=8)	# Limits how far decoding can get ahead of compression
+			self.thread = threading.Thread(target=self.compress,daemon=True)
+			self.thread.start()
+
+	def writable(self):
+		return True
+
+	def write(self,data):
+		if not self.compressor:
+			return self.target.write(data)
+		if self.error:
+			raise self.error
+		self.chunks.put(bytes(data))	# data may be the caller's buffer, which will be reused
+		return len(data)
+
+	def compress(self):
+		while True:
+			chunk = self.chunks.get()
+			if self.error:	# Keep draining the queue so that write does not block, up to the end marker from close
+				if chunk is None:
+					break
+				continue
+			start = time.perf_counter()
+			try:
+				if chunk is None:
+					output = self.compressor.flush()
+				else:
+					self.rawBytes += len(chunk)
+					output = self.compressor.compress(chunk)
+				if output:
+					self.target.write(output)
+					self.compressedBytes += len(output)
+			except Exception as error:
+				self.error = error
+			self.compressTime += time.perf_counter() - start
+			if chunk is None:
+				break
+
+	def close(self):
+		if self.closed:
+			return
+		super().close()
+		if self.compressor:
+			self.chunks.put(None)
+			self.thread.join()
+		if self.ownTarget:
+			self.target.close()
+		else:
+			self.target.flush()
+		if self.error:
+			raise self.error
+		if self.compressor:
+			ratio = 100 * self.compressedBytes / self.rawBytes if self.rawBytes else 0
+			rate = self.rawBytes / max(self.compressTime,1e-6) / 1e6
+			print(self.name + ':', self.rawBytes, 'bytes compressed to', self.compressedBytes, '(' + str(round(ratio,1)) + '%) at', round(rate,1), 'MB/second')
+
+def newCompressor(method):
+	if method == 'gzip':
+		return zlib.compressobj(6,zlib.DEFLATED,31)	# 31: with a gzip header
+	if method == 'xz':
+		return lzma.LZMACompressor()
+	try:
+		import zstandard
+	except ImportError:
+		print('The zstandard package is needed for zstd compression. Install it with: pip install zstandard')
+		raise SystemExit
+	return zstandard.ZstdCompressor().compressobj()
+
+def openOutput(fileName,options,encoding=None,stream=None,compress=True):
+#	Open an output file for writing text, compressed if asked for with --compress (unless compress is False).
+#	If stream is given (standard output), write to it instead of to the file.
+	if not compress and options.compress:
+		options = argparse.Namespace(**vars(options))
+		options.compress = None
+	if options.compress:
+		fileName += OutputSink.suffixes[options.compress]
+		compressor = newCompressor(options.compress)	# Before the file is created, in case the method is not available
+	else:
+		compressor = None
+	if stream is None:
+		try:
+			if not options.compress:
+				return open(fileName,'w', newline='', encoding=encoding, buffering=options.bufferSize or -1)
+			stream = open(fileName,'wb')
+			ownStream = True
+		except PermissionError:
+			print('Denied permission to open',fileName,'-- Maybe it is open in another program? If so, close it and try again.')
+			raise SystemExit
+		except:
+			print('Error opening',fileName,'--',sys.exc_info()[1])
+			raise SystemExit
+	else:
+		fileName = '<stdout>'
+		ownStream = False
+	sink = OutputSink(stream,fileName,compressor,ownStream)
+	bufferSize = options.bufferSize or (1 << 20 if options.compress else io.DEFAULT_BUFFER_SIZE)	# Compress in large chunks
+	return io.TextIOWrapper(io.BufferedWriter(sink,bufferSize),encoding=encoding,newline='')
+
+def windowsDoubleClick():
+#	A program started by double-clicking it in Windows Explorer has a console to itself
+#	ref https://stackoverflow.com/questions/55172090/detect-if-python-program-is-executed-via-windows-gui-double-click-vs-command-p
+	import ctypes
+	kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+	process_array = (ctypes.c_uint * 1)()
+	num_processes = kernel32.GetConsoleProcessList(process_array, 1)
+	return num_processes <= 2
+
+# How to tell, on each platform, whether the program was started by double-clicking it rather than from a command line.
+# Other platforms are taken to be a command line.
+launchDetectors = {'win32': windowsDoubleClick}
+
+def launchedByDoubleClick():	# Only called when it matters, i.e., when no output type was given
+	detector = launchDetectors.get(sys.platform)
+	return detector is not None and detector()
+
+outputTypes = {'avisys':'AviSys','ebird':'eBird','myebird':'MyEBirdData','report':'Report'}
+
+def parseDate(text):	# Convert YYYY-MM-DD from the command line to a raw AviSys date
+	try:
+		date = datetime.date.fromisoformat(text)
+	except ValueError:
+		raise argparse.ArgumentTypeError('expected a date as YYYY-MM-DD, not ' + repr(text))
+	return (date.year-1930) * 10000 + date.month * 100 + date.day
+
+def parsePositive(text):	# A count or size from the command line, which must be at least 1
+	try:
+		value = int(text)
+	except ValueError:
+		value = 0
+	if value < 1:
+		raise argparse.ArgumentTypeError('expected a positive whole number, not ' + repr(text))
+	return value
+
+def parseArguments(argv):
+	parser = argparse.ArgumentParser(prog='SightingsTOcsv',description='Export the sightings and field notes in an AviSys data folder to CSV.')
+	parser.add_argument('outputType',nargs='?',type=str.lower,choices=outputTypes,metavar='{AviSys,eBird,MyEBird,Report}',
+		help='the kind of file to produce (not case-sensitive). Default is AviSys, or eBird if started by double-click.')
+	folders = parser.add_mutually_exclusive_group()
+	folders.add_argument('--input-dir',dest='inputDir',default='',help='the AviSys data folder (default: current folder)')
+	folders.add_argument('--batch',nargs='+',metavar='FOLDER',
+		help='export several AviSys data folders at once. The output for each goes in a folder of the same name under --output-dir, or in the data folder itself.')
+	parser.add_argument('--output-dir',dest='outputDir',default='',help='where to write the output files (default: current folder)')
+	parser.add_argument('--jobs',type=parsePositive,default=None,help='how many folders to export at the same time with --batch (default: number of CPUs)')
+	parser.add_argument('--from',dest='fromDate',type=parseDate,default=0,metavar='YYYY-MM-DD',help='export only sightings on or after this date')
+	parser.add_argument('--to',dest='toDate',type=parseDate,default=0xffffffff,metavar='YYYY-MM-DD',help='export only sightings on or before this date')
+	parser.add_argument('--partition',dest='partitionBy',choices=['year','year-state'],
+		help='write the CSV file in parts, one per year or per year and state, with a manifest that lists them')
+	parser.add_argument('--compress',choices=OutputSink.suffixes,help='compress the output files (zstd needs the zstandard package)')
+	parser.add_argument('--stdout',action='store_true',help='write the CSV file to standard output, e.g. to pipe it to another program. Messages go to standard error.')
+	parser.add_argument('--buffer-size',dest='bufferSize',type=parsePositive,default=None,metavar='BYTES',
+		help='size of the write buffer for each output file (default: 1 MB when compressing, otherwise the system default)')
+	parser.add_argument('--recover',action='store_true',
+		help='skip the records AviSys lists as corrupt without reading them, and set aside sightings with an unknown species or place instead of stopping')
+	return parser.parse_args(argv)
+
+def formatDate(date):	# Convert a raw AviSys date to YYYY-MM-DD
+	return str(date // 10000 + 1930) + '-' + str((date // 100) % 100).rjust(2,'0') + '-' + str(date % 100).rjust(2,'0')
+
+
+def eBirdRow(row):
+	return {'Common name':row[0],'Genus':row[1],'Species':row[2],'Species Count':row[3],'Species Comment':row[4],
+		'Location':row[5],'Lat':'','Lng':'','Date':row[7],'Start time':'','State':row[8],'Country':row[9],
+		'Protocol':'historical','N. Observers':1,'Duration':'','Complete':'N','Distance':'','Area':'','Checklist comment':'Imported from AviSys'}
+
+def myEBirdRow(row):
+	return {'Submission ID':row[15],'Common Name':row[0],'Scientific Name':row[1]+' '+row[2],
+		'Taxonomic Order':row[14],'Count':row[3],'State/Province':row[9]+'-'+row[8],'County':row[13],'Location ID':'',
+		'Location':row[5],'Latitude':'','Longitude':'','Date':row[6],'Time':'','Protocol':'historical',
+		'Duration (Min)':'','All Obs Reported':0,'Distance Traveled (km)':'','Area Covered (ha)':'',
+		'Number of Observers':'1',
+		'Breeding Code':'',
+		'Observation Details':row[4],
+		'Checklist Comments':'Imported from AviSys',
+		'ML Catalog Numbers':''}
+
+def aviSysRow(row):
+	dateVal = row[6].split('-')
+	date = str(int(dateVal[1]))+'/'+str(int(dateVal[2]))+'/'+dateVal[0]
+	return {'Common name':row[0],'Genus':row[1],'Species':row[2],'Place':row[5],'Date':date,'Count':row[3],'Comment':row[4],
+		'State':row[8],'Nation':row[9],'Blank':'','SpeciesNo':row[9]}
+
+csvRowFormats = {'eBird':eBirdRow,'MyEBirdData':myEBirdRow,'AviSys':aviSysRow}	# Output row -> CSV fields, by output type
+
+class Partition:
+#	One partition of the CSV file. Rows are handed over in batches to a writer thread of its own.
+	def __init__(self,fileName,csvFields,options,year,region):
+		self.output = openOutput(fileName,options)
+		self.fileName = self.output.name
+		self.csvFields = csvFields
+		self.year = year
+		self.region = region
+		self.rows = 0
+		self.firstDate = None
+		self.lastDate = None
+		self.firstSubid = None
+		self.lastSubid = None
+		self.pending = []
+		self.error = None
+		self.batches = queue.Queue(maxsize=8)
+		self.thread = threading.Thread(target=self.write,daemon=True)
+		self.thread.start()
+
+	def add(self,row,fields):	# The rows arrive in date order
+		if not self.rows:
+			self.firstDate = row[6]
+			self.firstSubid = row[15]
+		self.lastDate = row[6]
+		self.lastSubid = row[15]
+		self.rows += 1
+		self.pending.append(fields)
+		if len(self.pending) >= 500:
+			self.batches.put(self.pending)
+			self.pending = []
+
+	def write(self):
+		writer = csv.DictWriter(self.output,fieldnames=self.csvFields)
+		try:
+			writer.writeheader()
+		except Exception as error:
+			self.error = error
+		while True:
+			batch = self.batches.get()
+			if batch is None:
+				break
+			if not self.error:	# After an error, just drain the queue
+				try:
+					writer.writerows(batch)
+				except Exception as error:
+					self.error = error
+
+	def close(self):
+		if self.pending:
+			self.batches.put(self.pending)
+		self.batches.put(None)
+		self.thread.join()
+		self.output.close()
+		(self.output,self.thread,self.batches) = (None,None,None)	# Only the counts are kept, for the manifest
+		if self.error:
+			raise self.error
+
+	def manifestEntry(self):
+		entry = {'file':os.path.basename(self.fileName),'year':self.year}
+		if self.region is not None:
+			entry['region'] = self.region
+		entry.update({'rows':self.rows,'firstDate':self.firstDate,'lastDate':self.lastDate,'firstSubid':self.firstSubid,'lastSubid':self.lastSubid})
+		return entry
+
+class PartitionedOutput:
+#	Write the CSV rows to one file per year, or per year and state, e.g., AviSys.sightings.eBird.2019.US-NC.csv,
+#	and list the partitions, with their row counts and ranges of dates, in a manifest (AviSys.sightings.eBird.manifest.json).
+#	The subids are assigned over all the rows before they are partitioned, so they are the same as in a single file.
+#	The rows arrive in date order, so a year's partitions are closed when the first row of a later year arrives;
+#	only one year's files and writer threads are open at a time.
+	def __init__(self,baseName,partitionBy,csvFields,options):
+		self.baseName = baseName
+		self.partitionBy = partitionBy
+		self.csvFields = csvFields
+		self.options = options
+		self.partitions = []	# All of them, for the manifest
+		self.open = {}	# This year's, by key
+		self.year = None
+
+	def closeYear(self):
+		for partition in self.open.values():
+			partition.close()
+		self.open = {}
+
+	def writerow(self,row,fields):
+		year = row[6][0:4]	# From the sort date, YYYY-MM-DD
+		if year != self.year:
+			self.closeYear()
+			self.year = year
+		if self.partitionBy == 'year':
+			region = None
+			key = year
+		else:
+			region = row[9]+'-'+row[8] if row[8] else row[9]	# Country-state, or just country if the state is unknown
+			key = year + '.' + ''.join(c if c.isalnum() or c in ' -' else '_' for c in region)
+		partition = self.open.get(key)
+		if partition is None:
+			partition = self.open[key] = Partition(self.baseName+'.'+key+'.csv',self.csvFields,self.options,year,region)
+			self.partitions.append(partition)
+		partition.add(row,fields)
+
+	def close(self):
+		self.closeYear()
+		manifest = openOutput(self.baseName+'.manifest.json',self.options,encoding='utf-8',compress=False)
+		json.dump({'partitionBy':self.partitionBy,'partitions':[partition.manifestEntry() for partition in self.partitions]},
+			manifest,indent=1,ensure_ascii=False)
+		manifest.close()
+		print(len(self.partitions),'partitions written. See',manifest.name)
+
+class Export:
+#	Export the sightings in one AviSys data folder.
+#	The input files are read from dataDir, and the output files are written to outputDir.
+#	If stream is given, the CSV file is written to it instead.
+	def __init__(self,dataDir,outputDir,outputType,options,stream=None):
+		self.outputDir = outputDir
+		self.stream = stream
+		self.outputType = outputType
+		self.options = options
+		self.errors = [] if options.recover else None	# Problems set aside in recovery mode
+
+		self.filespecs = FileSpecs(dataDir)
+
+		noteFile = os.path.join(dataDir,NOTE_FILE)
+		try:
+			notes_file = open(noteFile,"rb")
+		except FileNotFoundError:
+			print('Error: File',noteFile,'not found.')
+			raise SystemExit
+		except:
+			print("Error opening",noteFile,'--',sys.exc_info()[1])
+			raise SystemExit
+		self.notes = mapFile(notes_file)
+		notes_file.close()
+
+		self.noteIndex = readNoteIndex(dataDir)
+		self.decodedNames = {}	# Names decoded from this database; see decodeName
+		(self.name,self.genusName,self.speciesName) = readMaster(dataDir,self.decodedNames)
+		self.places = readPlaces(dataDir,self.filespecs,self.decodedNames)
+
+		self.association = readAssociate(dataDir,self.decodedNames)
+
+		self.dataFile = os.path.join(dataDir,DATA_FILE)
+		try:
+			sighting_file = open(self.dataFile,"rb")
+		except FileNotFoundError:
+			print('Error: File',self.dataFile,'not found.')
+			raise SystemExit
+		except:
+			print("Error opening",self.dataFile,'--',sys.exc_info()[1])
+			raise SystemExit
 
 # Format of SIGHTING.DAT
 # Header record
@@ -624,209 +1065,397 @@ except:
 # 40000000  [Central America]
 # 80000000  [Western Palearctic]
 
-header = sighting_file.read(filespecs.dataLrecl)	# Read header record
-marker = int.from_bytes(header[0:4],'little')
-corruptRecords = 0
-
-EXPORT_FILE += outputType+'.csv'
-try:
-	CSV = open(EXPORT_FILE,'w', newline='')
-except PermissionError:
-	print('Denied permission to open',EXPORT_FILE,'-- Maybe it is open in another program? If so, close it and try again.')
-	raise SystemExit
-except:
-	print('Error opening',EXPORT_FILE,'--',sys.exc_info()[1])
-	raise SystemExit
-
-try:
-	noteOut = open(NOTE_OUTPUT,'w', newline='')
-except PermissionError:
-	print('Denied permission to open',NOTE_OUTPUT,'-- Maybe it is open in another program? If so, close it and try again,')
-	raise SystemExit
-except:
-	print('Error opening',NOTE_OUTPUT,'--',sys.exc_info()[1])
-
-nrecs = int.from_bytes(header[8:12],"little")
-
-recordCount = 0
-while True:
-	sighting = sighting_file.read(filespecs.dataLrecl)
-	if not sighting:
-		break
-	recordCount+=1
-	corruptPointer = int.from_bytes(sighting[0:4],'little')
-	corruptedRecord = corruptPointer != 0
-	speciesNo = int.from_bytes(sighting[4:6],'little')
-	fieldnote = int.from_bytes(sighting[6:10],'little')
-	if fieldnote:
-		block = NoteBlock(FNotes,noteIndex[fieldnote])
-		fieldnoteText = block.extract()
-		noteDict[recordCount] = fieldnoteText
-	else:
-		fieldnoteText = ''
-	fieldnoteText = fieldnoteText.rstrip(' \n')
-	date = int.from_bytes(sighting[10:14],'little')
-	day = date % 100
-	month = (date // 100) % 100
-	year = (date // 10000) + 1930
-	date = str(month) + '/' + str(day) + '/' + str(year)
-	sortdate = str(year) + '-' + str(month).rjust(2,'0') + '-' + str(day).rjust(2,'0')
-	place = int.from_bytes(sighting[14:16],'little')
-	countryLen = sighting[16]
-	country = sighting[17:19].decode('Windows-1252')
-	
-	commentLen = sighting[filespecs.commentLenIndex]
-	shortComment = sighting[filespecs.commentOffset:filespecs.commentOffset+commentLen].decode('Windows-1252').strip()
-
-	comment = integrateNote(shortComment,fieldnoteText)
-
-	if outputType in ['eBird','MyEBirdData']:
-		comment = comment.replace("\n"," ")
-
-	if filespecs.tallyIndex > 0:
-		tally = int.from_bytes(sighting[filespecs.tallyIndex:filespecs.tallyIndex+2],'little')
-	else:
-		tally = 1
+		self.sightings = mapFile(sighting_file)
+		sighting_file.close()
 
-	if speciesNo in name:
-		commonName = name[speciesNo]
-	else:
-		commonName = '?'
-		if not corruptedRecord:
-			print("No name found for species number", speciesNo)
+	def sightingComment(self,sighting,fieldnote,recordNo):
+#	Decode the comment of a sighting record, and integrate its field note, if any.
+#	Returns the short (AviSys) comment, the text of the field note (None if there is none), and the integrated comment.
+		fieldnoteText = None
+		if fieldnote:
+			try:
+				fieldnoteText = NoteBlock(self.notes,self.noteIndex[fieldnote]).extract()
+			except ValueError as error:	# Export the sighting without its field note
+				self.reportError(recordNo,'Field note ' + str(fieldnote) + ': ' + str(error))
+
+		filespecs = self.filespecs
+		commentLen = sighting[filespecs.commentLenIndex]
+		shortComment = bytes(sighting[filespecs.commentOffset:filespecs.commentOffset+commentLen]).decode('Windows-1252').strip()
+
+		comment = integrateNote(shortComment,(fieldnoteText or '').rstrip(' \n'))
+
+		if self.outputType in ['eBird','MyEBirdData']:
+			comment = comment.replace("\n"," ")
+		return (shortComment,fieldnoteText,comment)
+
+	def decodedRows(self,rows):
+#	Yield copies of the output rows with the comment and field note decoded.
+#	Until then a row holds the field note number (index 4) in place of the comment,
+#	and the offset of its sighting record (index 12) in place of the short comment.
+#	The text of the field note, or None if there is none, is appended at index 16.
+		for row in rows:
+			row = row.copy()
+			fieldnote = row[4]
+			(shortComment,fieldnoteText,comment) = self.sightingComment(self.sightings[row[12]:row[12]+self.filespecs.dataLrecl],fieldnote,row[11])
+			row[4] = comment
+			row[12] = shortComment
+			row.append(fieldnoteText)
+			yield row
+
+	def writeFieldNote(self,noteOut,row):
+#	The entry for each note begins with species name -- date -- place on the first line, followed by a blank line.
+#	The text of the field note follows
+#	The note is terminated by a line of 80 equal signs (which is something that could not be part of the actual note).
+#	Note: If AviSys type output, the place is the AviSys place. If eBird type output, the associated eBird location, if any, is used as the place.
+		if row[16] is not None:
+			shortComment = row[12]
+			noteOut.write(row[0] +' -- '+ row[6] +' -- '+  row[5] + '\n\n')
+			if len(shortComment):
+				noteOut.write( 'Short comment: ' + shortComment + '\n\n')
+			noteOut.write(row[16] + '\n' + '==========================================================================================\n')
+
+	def corruptRecordList(self,head):
+#	Walk the linked list of corrupt records, starting from the record number in the header.
+#	Returns the set of corrupt record numbers, without looking at any other record.
+		(sightings,filespecs) = (self.sightings,self.filespecs)
+		corrupt = set()
+		numRecords = len(sightings) // filespecs.dataLrecl - 1
+		link = head
+		while link not in (0,0xffffffff):	# ffffffff ends the list
+			if link > numRecords or link in corrupt:
+				print('The list of corrupt records in',self.dataFile,'is broken at record',link,'-- Other corrupt records will be found as they are read.')
+				break
+			offset = link * filespecs.dataLrecl
+			nextLink = int.from_bytes(sightings[offset:offset+4],'little')
+			if nextLink == 0:	# Not a corrupt record, so it must be read like any other
+				print('The list of corrupt records in',self.dataFile,'is broken at record',link,'-- Other corrupt records will be found as they are read.')
+				break
+			corrupt.add(link)
+			link = nextLink
+		return corrupt
+
+	def reportError(self,recordNo,message):
+#	In recovery mode, set aside a record that cannot be exported and go on. Otherwise give up.
+		if self.errors is not None:
+			self.errors.append('Record ' + str(recordNo) + ': ' + message)
+		else:
+			print(message)
 			raise SystemExit
 
-	if place not in places:
-		if not corruptedRecord:
-			print("Place", place, "is not set")
-			raise SystemExit
+	def run(self):
+		(filespecs,sightings,noteIndex,places,association,options,outputType) = \
+			(self.filespecs,self.sightings,self.noteIndex,self.places,self.association,self.options,self.outputType)
+		(name,genusName,speciesName,decodedNames) = (self.name,self.genusName,self.speciesName,self.decodedNames)
+		outArray = []
+
+		header = sightings[0:filespecs.dataLrecl]	# Header record
+		marker = int.from_bytes(header[0:4],'little')	# First record in the list of corrupt records
+		corruptRecords = 0
+		corruptList = self.corruptRecordList(marker) if self.errors is not None else set()
+
+		if outputType == 'Report':
+			report = ListReport((name,genusName,speciesName))
+			reportCSV = openOutput(os.path.join(self.outputDir,REPORT_FILE+'csv'),options,stream=self.stream)
+			reportJSON = openOutput(os.path.join(self.outputDir,REPORT_FILE+'json'),options,encoding='utf-8')
 		else:
-			location = 'Unknown location'
-	else:
-		linkList = places[place].linklist
-		location = linkList[0] if linkList[0] != '' else \
-			linkList[1] if linkList[1] != '' else \
-			linkList[2] if linkList[2] != '' else \
-			linkList[3] if linkList[3] != '' else \
-			linkList[4] if linkList[4] != '' else \
-			linkList[5] if linkList[5] != '' else \
-			linkList[6]
-
-		if outputType == 'eBird' and location in association:
-			location = association[location].locationName	# Use associated eBird location name instead of AviSys place name
-
-	if len(linkList) > 3:	# linkList will be short for an unlinked location
-		if country == 'US':
-			state = stateCode[linkList[3]]
-		elif country == 'CA':
-			state = provinceCode[linkList[3]]
+			if not options.partitionBy:	# Otherwise each partition has a file of its own
+				CSV = openOutput(os.path.join(self.outputDir,EXPORT_FILE+outputType+'.csv'),options,stream=self.stream)
+			noteOut = openOutput(os.path.join(self.outputDir,NOTE_OUTPUT),options)
+
+		nrecs = int.from_bytes(header[8:12],"little")
+
+		recordCount = 0
+		filteredRecords = 0
+		for offset in range(filespecs.dataLrecl,len(sightings),filespecs.dataLrecl):
+			sighting = sightings[offset:offset+filespecs.dataLrecl]
+			recordCount+=1
+			if recordCount in corruptList:	# Known to be corrupt; don't bother to decode it
+				corruptRecords += 1
+				continue
+			corruptPointer = int.from_bytes(sighting[0:4],'little')
+			corruptedRecord = corruptPointer != 0
+			speciesNo = int.from_bytes(sighting[4:6],'little')
+			rawDate = int.from_bytes(sighting[10:14],'little')
+			if not corruptedRecord and not options.fromDate <= rawDate <= options.toDate:	# Outside the dates asked for
+				filteredRecords += 1
+				continue
+			day = rawDate % 100
+			month = (rawDate // 100) % 100
+			year = (rawDate // 10000) + 1930
+			date = str(month) + '/' + str(day) + '/' + str(year)
+			sortdate = str(year) + '-' + str(month).rjust(2,'0') + '-' + str(day).rjust(2,'0')
+			place = int.from_bytes(sighting[14:16],'little')
+			countryLen = sighting[16]
+			country = decodeName(sighting[17:19],decodedNames)
+
+			if speciesNo in name:
+				commonName = name[speciesNo]
+			else:
+				commonName = '?'
+				if not corruptedRecord:
+					self.reportError(recordCount,"No name found for species number " + str(speciesNo))
+					continue
+
+			try:
+				linkList = places[place].linklist
+			except KeyError as error:	# The place, or a place it is linked to, is not set
+				if not corruptedRecord:
+					if error.args[0] == place:
+						self.reportError(recordCount,"Place " + str(place) + " is not set")
+					else:
+						self.reportError(recordCount,"Place " + str(place) + " is linked to place " + str(error.args[0]) + ", which is not set")
+					continue
+				else:
+					location = 'Unknown location'
+					linkList = []
+			else:
+				location = linkList[0] if linkList[0] != '' else \
+					linkList[1] if linkList[1] != '' else \
+					linkList[2] if linkList[2] != '' else \
+					linkList[3] if linkList[3] != '' else \
+					linkList[4] if linkList[4] != '' else \
+					linkList[5] if linkList[5] != '' else \
+					linkList[6]
+
+				if outputType == 'eBird' and location in association:
+					location = association[location].locationName	# Use associated eBird location name instead of AviSys place name
+
+			if len(linkList) > 3:	# linkList will be short for an unlinked location
+				try:
+					if country == 'US':
+						state = stateCode[linkList[3]]
+					elif country == 'CA':
+						state = provinceCode[linkList[3]]
+					else:
+						state = linkList[3]
+				except KeyError:
+					if not corruptedRecord:
+						self.reportError(recordCount,"No state or province code for " + linkList[3] + " (" + country + ")")
+						continue
+					state = linkList[3]
+			else:
+				state = ''
+
+			if len(linkList) > 2:
+				county = linkList[2]
+			else:
+				county = ''
+
+			if outputType == 'Report':	# Only the lists are wanted, so there is no need to decode the field note and comment
+				if corruptedRecord:
+					corruptRecords += 1
+					print('Corrupt record found:',commonName,location,date,state,country)
+				else:
+					report.record(speciesNo,rawDate,country,state,county)
+				continue
+
+			fieldnote = int.from_bytes(sighting[6:10],'little')
+			if fieldnote and fieldnote not in noteIndex:
+				if not corruptedRecord:
+					self.reportError(recordCount,"Field note " + str(fieldnote) + " is not in " + NOTE_INDEX)
+				fieldnote = 0	# Export the sighting without its field note
+
+			if filespecs.tallyIndex > 0:
+				tally = int.from_bytes(sighting[filespecs.tallyIndex:filespecs.tallyIndex+2],'little')
+			else:
+				tally = 1
+
+			if corruptedRecord:
+				corruptRecords += 1
+				(shortComment,fieldnoteText,comment) = self.sightingComment(sighting,fieldnote,recordCount)
+				print('Corrupt record found:',commonName,location,date,state,country,comment)
+			else:
+				# The comment and field note are decoded only when the row is written; see decodedRows
+				outArray.append([commonName,genusName[speciesNo],speciesName[speciesNo],tally,fieldnote,location,sortdate,date,state,country,speciesNo,recordCount,offset,county,speciesNo])
+
+		if outputType == 'Report':
+			report.writeCSV(reportCSV)
+			report.writeJSON(reportJSON)
+			reportCSV.close()
+			reportJSON.close()
 		else:
-			state = linkList[3]
-	else:
-		state = ''
+			def sortkey(array):
+				return array[6]+array[5]	# date+location
 
-	if len(linkList) > 2:
-		county = linkList[2]
-	else:
-		county = ''
+			outArray.sort(key=sortkey)
+
+			if outputType == 'eBird':
+				csvFields = ['Common name','Genus','Species','Species Count','Species Comment','Location','Lat','Lng','Date','Start time','State','Country','Protocol','N. Observers','Duration','Complete','Distance','Area','Checklist comment','Important: Delete this header row before importing to eBird']
+			elif outputType == 'MyEBirdData':
+				csvFields = ['Submission ID','Common Name','Scientific Name','Taxonomic Order','Count','State/Province','County','Location ID','Location','Latitude','Longitude','Date','Time','Protocol','Duration (Min)','All Obs Reported','Distance Traveled (km)','Area Covered (ha)','Number of Observers','Breeding Code','Observation Details','Checklist Comments','ML Catalog Numbers']
+			else:
+				csvFields = ['Common name','Genus','Species','Place','Date','Count','Comment','State','Nation','Blank','SpeciesNo']
+
+			if options.partitionBy:
+				partitions = PartitionedOutput(os.path.join(self.outputDir,EXPORT_FILE+outputType),options.partitionBy,csvFields,options)
+			else:
+				partitions = None
+				CSVwriter = csv.DictWriter(CSV,fieldnames=csvFields)
+				CSVwriter.writeheader()
+
+			# Assign a "subid", i.e., a checklist number, to each unique date-location combination.
+			# If all counts for a subid are "1", replace them with "X".
+			subid = 0
+			currentKey = " "
+			rowcounter = 0
+			startRow = 0
+			eX = True if outputType != 'AviSys' else False
+			for row in outArray:
+				key = row[6]+row[5]
+				if key != currentKey:	# New date-location combination
+					if eX and subid:	# If all counts in previous subid were "1", set them to "X"
+						for i in range(startRow,rowcounter):
+							outArray[i][3] = 'X'
+					subid += 1	# unique subid for each date-location combination
+
+					startRow = rowcounter
+					currentKey = key
+					eX = True if outputType != 'AviSys' else False
+				if row[3] > 1:	# Count
+					eX = False	# Make note that there was a count > 1s
+				outArray[rowcounter].append(subid)	# should be index 15
+				rowcounter += 1					
+
+			# Write the rows, and the field note of each row, if any, to FieldNotes.txt
+			rowFields = csvRowFormats[outputType]
+			for row in self.decodedRows(outArray):
+				if partitions:
+					partitions.writerow(row,rowFields(row))
+				else:
+					CSVwriter.writerow(rowFields(row))
+				self.writeFieldNote(noteOut,row)
+
+			noteOut.close()
+			if partitions:
+				partitions.close()
+			else:
+				CSV.close()
+
+		if recordCount != nrecs:
+			print('Should be', nrecs, 'records, but counted', recordCount)
+		else:
+			print(nrecs,"records processed","from AviSys version", filespecs.version,"data.")
+		if corruptRecords:
+			if corruptRecords == 1:
+				print('File', self.dataFile, 'contains one corrupt record, which has been ignored. ')
+				print('To remove it from AviSys, run Utilities->Restructure sighting file.')
+			else:
+				print('File', self.dataFile, 'contains', corruptRecords, 'corrupt records, which have been ignored. ')
+				print('To remove them from AviSys, run Utilities->Restructure sighting file.')
+			print(nrecs-corruptRecords, 'records are valid.')
+		if filteredRecords:
+			print(filteredRecords, 'sightings outside the requested dates were not exported.')
+		if self.errors:
+			errorOut = openOutput(os.path.join(self.outputDir,ERROR_FILE),options)
+			errorFile = errorOut.name
+			errorOut.write('\n'.join(self.errors) + '\n')
+			errorOut.close()
+			print(len(self.errors), 'problems were found. See', errorFile)
+		return recordCount
+
+def exportFolder(dataDir,outputDir,outputType,options):
+#	Export one data folder of a batch, in a worker process.
+#	Anything it prints is captured, and a failure is returned rather than stopping the batch.
+	log = io.StringIO()
+	recordCount = 0
+	failure = None
+	start = time.perf_counter()
+	try:
+		with contextlib.redirect_stdout(log):
+			export = Export(dataDir,outputDir,outputType,options)
+			if outputDir:	# Only once the input files have opened, so a broken folder leaves nothing behind
+				os.makedirs(outputDir,exist_ok=True)
+			recordCount = export.run()
+	except SystemExit:	# The reason has already been printed
+		lines = log.getvalue().strip().split('\n')
+		failure = lines[-1] if lines[-1] else 'Export stopped'
+	except Exception:
+		failure = 'Error -- ' + repr(sys.exc_info()[1])
+	return (recordCount,time.perf_counter()-start,failure,log.getvalue())
+
+def batchOutputDirs(dataDirs,outputDir):
+#	Each folder's output goes to a folder of the same name under outputDir (made unique if two have the same name),
+#	or, without outputDir, to the data folder itself.
+	if not outputDir:
+		return list(dataDirs)
+	output = []
+	used = set()
+	for dataDir in dataDirs:
+		name = os.path.basename(os.path.normpath(os.path.abspath(dataDir)))
+		unique = name
+		suffix = 1
+		while unique in used:
+			suffix += 1
+			unique = name + '-' + str(suffix)
+		used.add(unique)
+		output.append(os.path.join(outputDir,unique))
+	return output
 
-	if corruptedRecord:
-		corruptRecords += 1
-		print('Corrupt record found:',commonName,location,date,state,country,comment)
+# The lines of a folder's log that are shown in batch mode: warnings, which begin with one of batchWarnings,
+# and lines that contain one of batchNotes (the recovery report, and compression ratio and speed)
+batchWarnings = ('Should be','File ','The list of corrupt records')
+batchNotes = ('problems were found. See',' bytes compressed to ')
+
+def exportBatch(dataDirs,outputType,options):
+#	Export many data folders concurrently with a pool of processes.
+#	A folder that fails is reported and the rest go on.
+	start = time.perf_counter()
+	totalRecords = 0
+	failures = 0
+	with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs) as pool:
+		futures = {}
+		for (dataDir,outputDir) in zip(dataDirs,batchOutputDirs(dataDirs,options.outputDir)):
+			futures[pool.submit(exportFolder,dataDir,outputDir,outputType,options)] = dataDir
+		for future in concurrent.futures.as_completed(futures):
+			dataDir = futures[future]
+			try:
+				(recordCount,seconds,failure,log) = future.result()
+			except Exception:	# The worker process itself died
+				(recordCount,seconds,failure,log) = (0,0,'Error -- ' + repr(sys.exc_info()[1]),'')
+			if failure:
+				failures += 1
+				print(dataDir + ': FAILED --', failure)
+			else:
+				totalRecords += recordCount
+				print(dataDir + ':', recordCount, 'records in', round(seconds,2), 'seconds (' + str(round(recordCount/max(seconds,1e-6))), 'records/second)')
+				for line in log.split('\n'):
+					if line.startswith(batchWarnings) or any(note in line for note in batchNotes):
+						print('\t' + line)
+	seconds = time.perf_counter() - start
+	print(len(dataDirs)-failures, 'of', len(dataDirs), 'folders exported;', totalRecords, 'records in', round(seconds,2), 'seconds (' + str(round(totalRecords/max(seconds,1e-6))), 'records/second)')
+	return failures
+
+def main(argv):
+	options = parseArguments(argv)
+	if options.stdout and options.batch:
+		print('--stdout cannot be used with --batch')
+		raise SystemExit(2)
+	if options.partitionBy and (options.stdout or options.outputType == 'report'):
+		print('--partition cannot be used with --stdout or Report')
+		raise SystemExit(2)
+	print('SightingsTOcsv version ' + Version, file=sys.stderr if options.stdout else sys.stdout)
+
+	if options.outputType is None:	# If no output type on the command line
+		if launchedByDoubleClick():	# Run from double-click
+			outputType = 'eBird'
+		else:					# Run from command line
+			outputType = 'AviSys'
 	else:
-		outArray.append([commonName,genusName[speciesNo],speciesName[speciesNo],tally,comment,location,sortdate,date,state,country,speciesNo,recordCount,shortComment,county,speciesNo])
-
-def sortkey(array):
-	return array[6]+array[5]	# date+location
-
-outArray.sort(key=sortkey)
-
-if outputType == 'eBird':
-	csvFields = ['Common name','Genus','Species','Species Count','Species Comment','Location','Lat','Lng','Date','Start time','State','Country','Protocol','N. Observers','Duration','Complete','Distance','Area','Checklist comment','Important: Delete this header row before importing to eBird']
-elif outputType == 'MyEBirdData':
-	csvFields = ['Submission ID','Common Name','Scientific Name','Taxonomic Order','Count','State/Province','County','Location ID','Location','Latitude','Longitude','Date','Time','Protocol','Duration (Min)','All Obs Reported','Distance Traveled (km)','Area Covered (ha)','Number of Observers','Breeding Code','Observation Details','Checklist Comments','ML Catalog Numbers']
-else:
-	csvFields = ['Common name','Genus','Species','Place','Date','Count','Comment','State','Nation','Blank','SpeciesNo']
-
-CSVwriter = csv.DictWriter(CSV,fieldnames=csvFields)
-CSVwriter.writeheader()
-
-# Assign a "subid", i.e., a checklist number, to each unique date-location combination.
-# If all counts for a subid are "1", replace them with "X".
-subid = 0
-currentKey = " "
-rowcounter = 0
-startRow = 0
-eX = True if outputType != 'AviSys' else False
-for row in outArray:
-	key = row[6]+row[5]
-	if key != currentKey:	# New date-location combination
-		if eX and subid:	# If all counts in previous subid were "1", set them to "X"
-			for i in range(startRow,rowcounter):
-				outArray[i][3] = 'X'
-		subid += 1	# unique subid for each date-location combination
-
-		startRow = rowcounter
-		currentKey = key
-		eX = True if outputType != 'AviSys' else False
-	if row[3] > 1:	# Count
-		eX = False	# Make note that there was a count > 1s
-	outArray[rowcounter].append(subid)	# should be index 15
-	rowcounter += 1					
-
-if outputType == 'eBird':
-	for row in outArray:
-		CSVwriter.writerow({'Common name':row[0],'Genus':row[1],'Species':row[2],'Species Count':row[3],'Species Comment':row[4],
-			'Location':row[5],'Lat':'','Lng':'','Date':row[7],'Start time':'','State':row[8],'Country':row[9],
-			'Protocol':'historical','N. Observers':1,'Duration':'','Complete':'N','Distance':'','Area':'','Checklist comment':'Imported from AviSys'})
-
-elif outputType == 'MyEBirdData':
-	for row in outArray:
-		CSVwriter.writerow({'Submission ID':row[15],'Common Name':row[0],'Scientific Name':row[1]+' '+row[2],
-			'Taxonomic Order':row[14],'Count':row[3],'State/Province':row[9]+'-'+row[8],'County':row[13],'Location ID':'',
-			'Location':row[5],'Latitude':'','Longitude':'','Date':row[6],'Time':'','Protocol':'historical',
-			'Duration (Min)':'','All Obs Reported':0,'Distance Traveled (km)':'','Area Covered (ha)':'',
-			'Number of Observers':'1',
-			'Breeding Code':'',
-			'Observation Details':row[4],
-			'Checklist Comments':'Imported from AviSys',
-			'ML Catalog Numbers':''})
-		
-else:
-	for row in outArray:
-		dateVal = row[6].split('-')
-		date = str(int(dateVal[1]))+'/'+str(int(dateVal[2]))+'/'+dateVal[0]
-
-		CSVwriter.writerow({'Common name':row[0],'Genus':row[1],'Species':row[2],'Place':row[5],'Date':date,'Count':row[3],'Comment':row[4],
-			'State':row[8],'Nation':row[9],'Blank':'','SpeciesNo':row[9]})
-
-# Write all field notes to a file
-# The entry for each note begins with species name -- date -- place on the first line, followed by a blank line.
-# The text of the field note follows
-# The note is terminated by a line of 80 equal signs (which is something that could not be part of the actual note).
-# Note: If AviSys type output, the place is the AviSys place. If eBird type output, the associated eBird location, if any, is used as the place.
-for row in outArray:
-	recordNo = row[11]
-	if recordNo in noteDict:
-		shortComment = row[12]
-		noteOut.write(row[0] +' -- '+ row[6] +' -- '+  row[5] + '\n\n')
-		if len(shortComment):
-			noteOut.write( 'Short comment: ' + shortComment + '\n\n')
-		noteOut.write(noteDict[recordNo] + '\n' + '==========================================================================================\n')
-
-sighting_file.close()
-noteOut.close()
-CSV.close()
-
-if recordCount != nrecs:
-	print('Should be', nrecs, 'records, but counted', recordCount)
-else:
-	print(nrecs,"records processed","from AviSys version", filespecs.version,"data.")
-if corruptRecords:
-	if corruptRecords == 1:
-		print('File', DATA_FILE, 'contains one corrupt record, which has been ignored. ')
-		print('To remove it from AviSys, run Utilities->Restructure sighting file.')
+		outputType = outputTypes[options.outputType]
+
+	if options.batch:
+		if exportBatch(options.batch,outputType,options):
+			raise SystemExit(1)
+	elif options.stdout:	# Keep messages out of the CSV
+		stream = sys.stdout.buffer
+		with contextlib.redirect_stdout(sys.stderr):
+			Export(options.inputDir,options.outputDir,outputType,options,stream).run()
 	else:
-		print('File', DATA_FILE, 'contains', corruptRecords, 'corrupt records, which have been ignored. ')
-		print('To remove them from AviSys, run Utilities->Restructure sighting file.')
-	print(nrecs-corruptRecords, 'records are valid.')
+		Export(options.inputDir,options.outputDir,outputType,options).run()
+
+
+#########################################################################################################
+######################################## The program starts here ########################################
+#########################################################################################################
+if __name__ == '__main__':
+	main(sys.argv[1:])
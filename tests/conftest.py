@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(TESTS))	# For SightingsTOcsv
+sys.path.insert(0,TESTS)	# For fixturedb
+
+PERF_BASELINE = os.path.join(TESTS,'perf_baseline.json')
+
+def pytest_addoption(parser):
+	parser.addoption('--update-golden',action='store_true',help='rewrite the golden output files from the current code')
+	parser.addoption('--update-perf-baseline',action='store_true',help='rewrite the stored performance baselines from this run')
+
+def pytest_configure(config):
+	config.addinivalue_line('markers','perf: timing and allocation tests, compared with stored baselines')
+
+@pytest.fixture
+def updateGolden(request):
+	return request.config.getoption('--update-golden')
+
+@pytest.fixture(scope='session')
+def perfBaseline(request):
+#	The stored baselines, as a dict. With --update-perf-baseline, the tests put their measurements in it
+#	and it is written back at the end of the session.
+	update = request.config.getoption('--update-perf-baseline')
+	baseline = {}
+	if os.path.exists(PERF_BASELINE):
+		with open(PERF_BASELINE) as input:
+			baseline = json.load(input)
+	baseline['update'] = update
+	yield baseline
+	del baseline['update']
+	if update:
+		with open(PERF_BASELINE,'w') as output:
+			json.dump(baseline,output,indent=1,sort_keys=True)
+			output.write('\n')
@@ -0,0 +1,182 @@
+# Build small AviSys databases for the tests, in the layouts of AviSys versions 4, 5 and 6.
+# The databases include corrupt records, a field note that spans several blocks,
+# a comment that duplicates the beginning of its field note (as when imported from eBird),
+# and a place that is not linked to any other place.
+
+import os
+
+SPECIES = [	# species number, common name, genus, species
+	(101,'Canada Goose','Branta','canadensis'),
+	(205,'Wood Duck','Aix','sponsa'),
+	(1500,'Carolina Wren','Thryothorus','ludovicianus'),
+	(1830,'Northern Cardinal','Cardinalis','cardinalis'),
+]
+
+NOTES = {	# field note number, text
+	1:'Eight birds on the pond.\nSecond line of the note.\n',
+	2:'Trip :: 2019-05-04 Yard\nFlock of twenty feeding\non the lawn.\n' + ''.join('Line ' + str(i) + ' of a long note.\n' for i in range(6)),
+	3:'A note for the corrupt record.\n',
+}
+
+def rawDate(year,month,day):
+	return (year-1930) * 10000 + month * 100 + day
+
+def placeRecords(divisor):
+#	(place number, name, linked place number). The place number determines the level (table) of the place.
+	(site,city,county,state,country,region) = [1 + divisor * table for table in range(6)]
+	return [
+		(site,'Yates Mill Pond',county),
+		(site+1,'Point Pelee',state+1),
+		(site+3,'Lake Johnson',city),
+		(city,'Raleigh',county),
+		(county,'Wake',state),
+		(state,'North Carolina',country),
+		(state+1,'Ontario',country+1),
+		(country,'United States',region),
+		(country+1,'Canada',region),
+		(region,'North America',0),
+		(site+2,'Unlinked Spot',0),
+	]
+
+def sightingRecords(divisor):
+#	(species, field note, date, place, country, comment, count, corrupt record link)
+	return [
+		(101,1,rawDate(2019,5,4),1,'US','Pond',8,0),
+		(1830,0,rawDate(2019,5,4),1,'US','',1,0),
+		(205,2,rawDate(2019,5,4),4,'US','/B (Yard) Flock of twenty',1,0),
+		(1500,0,rawDate(2019,5,4),4,'US','Singing',1,0),
+		(999,3,rawDate(2020,1,1),1,'US','corrupt',1,0xffffffff),	# End of the corrupt record list
+		(1500,0,rawDate(1995,12,31),2,'CA','Caf\xe9 stop',1,0),
+		(101,0,rawDate(2021,7,15),3,'GB','Unlinked place',3,0),
+		(1830,0,rawDate(2018,2,3),1+2*divisor,'US','County only',1,0),
+		(205,0,rawDate(2022,8,9),2,'CA','x' * 60,2,0),
+		(101,0,rawDate(2019,5,4),4,'US','',1,5),	# Head of the corrupt record list, linked to record 5
+	]
+
+def putString(record,lenIndex,text):	# Store a string preceded by its length
+	data = text.encode('Windows-1252')
+	record[lenIndex] = len(data)
+	record[lenIndex+1:lenIndex+1+len(data)] = data
+
+def writeMaster(path):
+	with open(os.path.join(path,'MASTER.AVI'),'wb') as output:
+		for (speciesNo,name,genus,species) in SPECIES:
+			record = bytearray(110)
+			record[0] = 0x2a
+			record[5:7] = speciesNo.to_bytes(2,'little')
+			putString(record,7,name)
+			putString(record,52,genus)
+			putString(record,77,species)
+			output.write(record)
+
+def writePlaces(path,version):
+	divisor = 80 if version == 4 else 450
+	recl = 39 if version == 6 else 27
+	link = 37 if version == 6 else 25
+	size = {4:11340, 5:63450, 6:39*2800}[version]	# FileSpecs tells version 4 from 5 by the size of PLACES.AVI
+	data = bytearray(size)
+	for (i,(placeNumber,name,linked)) in enumerate(placeRecords(divisor)):
+		record = bytearray(recl)
+		record[0:2] = placeNumber.to_bytes(2,'little')
+		putString(record,6,name)
+		record[link:link+2] = linked.to_bytes(2,'little')
+		data[i*recl:(i+1)*recl] = record
+	with open(os.path.join(path,'PLACES.AVI'),'wb') as output:
+		output.write(data)
+
+def writeNotes(path):
+#	FNotes.DAT: a header block, then each note as a chain of 512-byte blocks holding 125-byte lines.
+#	FNotes.IX: a header block, then one block of 14-byte index entries.
+	blocks = [bytearray(512)]
+	index = {}
+	for (noteNo,text) in NOTES.items():
+		data = b''.join(bytes([len(line)]) + line.ljust(124) for line in [line.encode('Windows-1252') for line in text.rstrip('\n').split('\n')])
+		index[noteNo] = len(blocks)
+		first = True
+		while data:
+			block = bytearray(512)
+			if first:
+				(chunk,data) = (data[:498],data[498:])
+				block[4:8] = noteNo.to_bytes(4,'little')
+				block[8:8+len(chunk)] = chunk
+				block[506:508] = (8+len(chunk)).to_bytes(2,'little')
+				first = False
+			else:
+				(chunk,data) = (data[:505],data[505:])
+				block[0] = 1
+				block[1:1+len(chunk)] = chunk
+				block[506:508] = len(chunk).to_bytes(2,'little')
+			if data:
+				block[508:512] = (len(blocks)+1).to_bytes(4,'little')
+			blocks.append(block)
+	with open(os.path.join(path,'FNotes.DAT'),'wb') as output:
+		output.write(b''.join(blocks))
+
+	header = bytearray(874)
+	header[0:4] = b'\xff\xff\xff\xff'
+	header[8:12] = (2).to_bytes(4,'little')
+	header[12:16] = (874).to_bytes(4,'little')
+	header[22:26] = len(index).to_bytes(4,'little')
+	header[26:30] = (62).to_bytes(4,'little')
+	block = bytearray(874)
+	block[0] = len(index)
+	for (i,(noteNo,blockNumber)) in enumerate(index.items()):
+		ptr = 6 + 14*i
+		block[ptr:ptr+4] = blockNumber.to_bytes(4,'little')
+		block[ptr+8] = 5
+		block[ptr+9:ptr+14] = str(noteNo).rjust(5,'0').encode()
+	with open(os.path.join(path,'FNotes.IX'),'wb') as output:
+		output.write(header + block)
+
+def writeSightings(path,version,copies):
+#	copies repeats the sightings, to make a bigger file for timing
+	lrecl = 111 if version == 6 else 76
+	commentLenIndex = 28 if version == 6 else 27
+	maxComment = 80 if version == 6 else 48
+	sightings = sightingRecords(80 if version == 4 else 450)
+	header = bytearray(lrecl)
+	header[0:4] = (10).to_bytes(4,'little')	# First record in the corrupt record list
+	header[8:12] = (len(sightings)*copies).to_bytes(4,'little')
+	header[12] = lrecl
+	records = []
+	for copy in range(copies):
+		for (speciesNo,note,date,place,country,comment,count,link) in sightings:
+			record = bytearray(lrecl)
+			if link and link != 0xffffffff:
+				link += copy * len(sightings)
+			elif link == 0xffffffff and copy < copies-1:
+				link = 10 + (copy+1) * len(sightings)	# Chain on to the next copy's corrupt records
+			record[0:4] = link.to_bytes(4,'little')
+			record[4:6] = speciesNo.to_bytes(2,'little')
+			record[6:10] = note.to_bytes(4,'little')
+			record[10:14] = date.to_bytes(4,'little')
+			record[14:16] = place.to_bytes(2,'little')
+			putString(record,16,country)
+			putString(record,commentLenIndex,comment[:maxComment])
+			if version == 6:
+				record[109:111] = count.to_bytes(2,'little')
+			records.append(record)
+	with open(os.path.join(path,'SIGHTING.DAT'),'wb') as output:
+		output.write(header + b''.join(records))
+
+def writeAssociations(path):
+	record = bytearray(152)
+	putString(record,0,'Yates Mill Pond')
+	putString(record,34,'L123456')
+	putString(record,42,'Yates Mill County Park')
+	putString(record,103,'35.7196')
+	putString(record,124,'-78.6847')
+	putString(record,145,'NC')
+	putString(record,149,'US')
+	with open(os.path.join(path,'ASSOCIAT.AVI'),'wb') as output:
+		output.write(record)
+
+def buildDatabase(path,version,copies=1):
+	os.makedirs(path,exist_ok=True)
+	writeMaster(path)
+	writePlaces(path,version)
+	writeNotes(path)
+	writeSightings(path,version,copies)
+	if version == 6:
+		writeAssociations(path)
+	return path
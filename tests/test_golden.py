@@ -0,0 +1,232 @@
+# Compare the exported files, byte for byte, with the golden copies in tests/golden.
+# After an intended change in the output, rewrite them with: pytest --update-golden
+
+import os
+import io
+import sys
+import gzip
+import json
+import lzma
+import shutil
+import subprocess
+import threading
+import pytest
+
+import SightingsTOcsv
+from fixturedb import buildDatabase, putString
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT,'SightingsTOcsv.py')
+GOLDEN = os.path.join(ROOT,'tests','golden')
+
+def export(tmp_path,version,outputType,*arguments):
+#	Run the exporter on a fixture database. UTF-8 mode makes the output the same on every platform.
+	dataDir = buildDatabase(str(tmp_path / 'data'),version)
+	outputDir = tmp_path / 'output'
+	outputDir.mkdir()
+	result = subprocess.run([sys.executable,'-X','utf8',SCRIPT,outputType,'--input-dir',dataDir,'--output-dir',str(outputDir)] + list(arguments),
+		capture_output=True,text=True)
+	assert result.returncode == 0, result.stdout + result.stderr
+	return (outputDir,result.stdout)
+
+def readBytes(fileName):
+	with open(fileName,'rb') as input:
+		return input.read()
+
+@pytest.mark.parametrize('outputType',['AviSys','eBird','MyEBird','Report'])
+@pytest.mark.parametrize('version',[4,5,6])
+def test_golden_output(tmp_path,version,outputType,updateGolden):
+	(outputDir,log) = export(tmp_path,version,outputType)
+	goldenDir = os.path.join(GOLDEN,'v'+str(version),outputType)
+	if updateGolden:
+		shutil.rmtree(goldenDir,ignore_errors=True)
+		shutil.copytree(outputDir,goldenDir)
+		return
+	assert sorted(os.listdir(outputDir)) == sorted(os.listdir(goldenDir))
+	for fileName in os.listdir(goldenDir):
+		assert readBytes(outputDir / fileName) == readBytes(os.path.join(goldenDir,fileName)), fileName
+
+@pytest.mark.parametrize('version',[4,5,6])
+def test_corrupt_records_reported(tmp_path,version):
+	(outputDir,log) = export(tmp_path,version,'AviSys')
+	assert '10 records processed from AviSys version ' + str(version) + ' data.' in log
+	assert 'contains 2 corrupt records, which have been ignored.' in log
+	assert 'Corrupt record found: ? Yates Mill Pond 1/1/2020' in log
+
+def test_recover_skips_listed_corrupt_records(tmp_path):
+	(outputDir,log) = export(tmp_path,6,'eBird','--recover')
+	assert 'Corrupt record found' not in log	# Skipped without being decoded
+	assert 'contains 2 corrupt records' in log
+	for fileName in ['AviSys.sightings.eBird.csv','FieldNotes.txt']:
+		assert readBytes(outputDir / fileName) == readBytes(os.path.join(GOLDEN,'v6','eBird',fileName))
+
+def test_recover_broken_corrupt_list(tmp_path):
+#	A list that leads to a valid record must not cost that record
+	dataDir = buildDatabase(str(tmp_path / 'data'),6)
+	with open(os.path.join(dataDir,'SIGHTING.DAT'),'r+b') as data:
+		data.write((1).to_bytes(4,'little'))	# Head of the list: record 1, which is valid
+	outputDir = tmp_path / 'output'
+	outputDir.mkdir()
+	result = subprocess.run([sys.executable,'-X','utf8',SCRIPT,'eBird','--recover','--input-dir',dataDir,'--output-dir',str(outputDir)],
+		capture_output=True,text=True)
+	assert result.returncode == 0, result.stdout + result.stderr
+	assert 'is broken at record 1' in result.stdout
+	for fileName in ['AviSys.sightings.eBird.csv','FieldNotes.txt']:
+		assert readBytes(outputDir / fileName) == readBytes(os.path.join(GOLDEN,'v6','eBird',fileName))
+
+def test_recover_sets_aside_unknown_species(tmp_path):
+	dataDir = buildDatabase(str(tmp_path / 'data'),6)
+	with open(os.path.join(dataDir,'SIGHTING.DAT'),'r+b') as data:
+		data.seek(2*111 + 4)	# Species number of record 2
+		data.write((777).to_bytes(2,'little'))
+	result = subprocess.run([sys.executable,'-X','utf8',SCRIPT,'--input-dir',dataDir,'--output-dir',str(tmp_path)],capture_output=True,text=True)
+	assert 'No name found for species number 777' in result.stdout
+	result = subprocess.run([sys.executable,'-X','utf8',SCRIPT,'--recover','--input-dir',dataDir,'--output-dir',str(tmp_path)],capture_output=True,text=True)
+	assert result.returncode == 0
+	with open(tmp_path / 'AviSys.errors.txt') as errors:
+		assert errors.read() == 'Record 2: No name found for species number 777\n'
+
+def recoverPlaces(tmp_path,change):
+#	Change PLACES.AVI of the version 6 fixture, export it in recovery mode, and return the error report
+	dataDir = buildDatabase(str(tmp_path / 'data'),6)
+	with open(os.path.join(dataDir,'PLACES.AVI'),'r+b') as places:
+		data = bytearray(places.read())
+		change(data)
+		places.seek(0)
+		places.write(data)
+	result = subprocess.run([sys.executable,'-X','utf8',SCRIPT,'--recover','--input-dir',dataDir,'--output-dir',str(tmp_path)],capture_output=True,text=True)
+	assert result.returncode == 0, result.stdout + result.stderr
+	with open(tmp_path / 'AviSys.errors.txt') as errors:
+		return errors.read()
+
+def test_recover_sets_aside_missing_linked_place(tmp_path):
+	def change(data):
+		data[2*39+37:2*39+39] = (3000).to_bytes(2,'little')	# Lake Johnson, place 4, linked to a place that is not set
+	assert recoverPlaces(tmp_path,change) == \
+		'Record 3: Place 4 is linked to place 3000, which is not set\nRecord 4: Place 4 is linked to place 3000, which is not set\n'
+
+def test_recover_sets_aside_unknown_state(tmp_path):
+	def change(data):
+		record = data[5*39:6*39]
+		putString(record,6,'Carolina del Norte')	# Not in stateCode
+		data[5*39:6*39] = record
+	errors = recoverPlaces(tmp_path,change).split('\n')
+	assert errors[0] == 'Record 1: No state or province code for Carolina del Norte (US)'
+	assert len(errors) == 6	# Records 1-4 and 8, and the empty string after the last line
+
+@pytest.mark.parametrize('method,suffix,opener',[('gzip','.gz',gzip.open),('xz','.xz',lzma.open)])
+def test_compressed_output(tmp_path,method,suffix,opener):
+	(outputDir,log) = export(tmp_path,6,'MyEBird','--compress',method)
+	for fileName in ['AviSys.sightings.MyEBirdData.csv','FieldNotes.txt']:
+		with opener(outputDir / (fileName + suffix),'rb') as input:
+			assert input.read() == readBytes(os.path.join(GOLDEN,'v6','MyEBird',fileName))
+	assert 'compressed to' in log
+
+class FullDisk(io.RawIOBase):
+	def writable(self):
+		return True
+	def write(self,data):
+		raise OSError(28,'No space left on device')
+
+def test_compressed_output_error():
+#	A target that fails stops the compression thread, and close raises the error rather than waiting forever
+	sink = SightingsTOcsv.OutputSink(FullDisk(),'full',SightingsTOcsv.newCompressor('gzip'))
+	with pytest.raises(OSError):	# Raised by a later write, once the thread has failed
+		for i in range(200):
+			sink.write(os.urandom(1 << 16))	# Incompressible, so output is written before the end
+	result = []
+	def close():
+		try:
+			sink.close()
+		except OSError as error:
+			result.append(error)
+	closer = threading.Thread(target=close,daemon=True)
+	closer.start()
+	closer.join(10)
+	assert not closer.is_alive(), 'close did not return'
+	assert result and result[0].errno == 28
+
+@pytest.mark.parametrize('size',['-1','0','1k'])
+def test_bad_buffer_size(size):
+	with pytest.raises(SystemExit):
+		SightingsTOcsv.parseArguments(['--compress','gzip','--buffer-size',size])
+
+def test_missing_compressor_leaves_no_file(tmp_path,monkeypatch):
+	monkeypatch.setitem(sys.modules,'zstandard',None)	# import zstandard fails
+	options = SightingsTOcsv.parseArguments(['--compress','zstd'])
+	with pytest.raises(SystemExit):
+		SightingsTOcsv.openOutput(str(tmp_path / 'out.csv'),options)
+	assert os.listdir(tmp_path) == []
+
+def test_date_filter(tmp_path):
+	(outputDir,log) = export(tmp_path,6,'AviSys','--from','2019-01-01','--to','2019-12-31')
+	with open(outputDir / 'AviSys.sightings.AviSys.csv',encoding='utf-8',newline='') as input:
+		rows = input.read().split('\r\n')
+	assert len([row for row in rows if ',5/4/2019,' in row]) == 4
+	assert '4 sightings outside the requested dates were not exported.' in log
+
+@pytest.mark.parametrize('partitionBy',['year','year-state'])
+def test_partitioned_output(tmp_path,partitionBy):
+#	The partitions, in the order of the manifest, hold the rows of the golden file, subids included.
+	(outputDir,log) = export(tmp_path,6,'MyEBird','--partition',partitionBy)
+	with open(outputDir / 'AviSys.sightings.MyEBirdData.manifest.json',encoding='utf-8') as input:
+		manifest = json.load(input)
+	assert manifest['partitionBy'] == partitionBy
+	golden = readBytes(os.path.join(GOLDEN,'v6','MyEBird','AviSys.sightings.MyEBirdData.csv')).split(b'\r\n')
+	rows = [golden[0]]
+	for partition in manifest['partitions']:
+		lines = readBytes(outputDir / partition['file']).split(b'\r\n')
+		assert lines[0] == golden[0]
+		assert len(lines) - 2 == partition['rows']
+		rows.extend(lines[1:-1])
+	assert rows == golden[:-1]
+	assert not os.path.exists(outputDir / 'AviSys.sightings.MyEBirdData.csv')
+
+def test_batch(tmp_path):
+#	Each folder's warnings and compression ratios are shown with its line, and a folder that fails leaves no output folder
+	dataDirs = [buildDatabase(str(tmp_path / 'v4'),4),buildDatabase(str(tmp_path / 'v6'),6),str(tmp_path / 'missing')]
+	outputDir = tmp_path / 'output'
+	result = subprocess.run([sys.executable,'-X','utf8',SCRIPT,'eBird','--batch'] + dataDirs + ['--output-dir',str(outputDir),'--jobs','2','--compress','gzip'],
+		capture_output=True,text=True)
+	assert result.returncode == 1
+	assert '2 of 3 folders exported' in result.stdout
+	assert '\tFile ' + os.path.join(dataDirs[1],'SIGHTING.DAT') + ' contains 2 corrupt records' in result.stdout
+	assert '\t' + os.path.join(str(outputDir),'v6','AviSys.sightings.eBird.csv.gz') + ': 1474 bytes compressed to' in result.stdout
+	assert sorted(os.listdir(outputDir)) == ['v4','v6']
+	with gzip.open(outputDir / 'v6' / 'AviSys.sightings.eBird.csv.gz','rb') as input:
+		assert input.read() == readBytes(os.path.join(GOLDEN,'v6','eBird','AviSys.sightings.eBird.csv'))
+
+def test_bad_jobs():
+	with pytest.raises(SystemExit):
+		SightingsTOcsv.parseArguments(['--batch','data','--jobs','0'])
+
+def test_partitions_closed_by_year(tmp_path):
+#	Only one year's partitions are open at a time, however many years there are
+	options = SightingsTOcsv.parseArguments(['--partition','year-state'])
+	output = SightingsTOcsv.PartitionedOutput(str(tmp_path / 'out'),'year-state',['Count'],options)
+	threads = threading.active_count()
+	for year in range(1700,2000):
+		for state in ['NC','VA']:
+			row = [''] * 16
+			(row[6],row[8],row[9],row[15]) = (str(year)+'-05-04',state,'US',year-1699)
+			output.writerow(row,{'Count':1})
+		assert len(output.open) == 2
+		assert threading.active_count() <= threads + 2
+	output.close()
+	assert len(output.partitions) == 600
+	assert (tmp_path / 'out.1999.US-VA.csv').read_bytes() == b'Count\r\n1\r\n'
+
+def test_note_chain_loop(tmp_path):
+#	A chain of note blocks that leads back to itself stops the export, or in recovery mode is reported
+	dataDir = buildDatabase(str(tmp_path / 'data'),6)
+	with open(os.path.join(dataDir,'FNotes.DAT'),'r+b') as notes:
+		notes.seek(512 + 508)	# Link to the next block, in block 1
+		notes.write((1).to_bytes(4,'little'))
+	arguments = [sys.executable,'-X','utf8',SCRIPT,'eBird','--input-dir',dataDir,'--output-dir',str(tmp_path)]
+	result = subprocess.run(arguments,capture_output=True,text=True,timeout=60)
+	assert 'is broken at block 1' in result.stdout
+	assert 'records processed' not in result.stdout
+	result = subprocess.run(arguments + ['--recover'],capture_output=True,text=True,timeout=60)
+	assert result.returncode == 0, result.stdout + result.stderr
+	with open(tmp_path / 'AviSys.errors.txt') as errors:
+		assert 'The chain of blocks in FNotes.DAT is broken at block 1' in errors.read()
@@ -0,0 +1,113 @@
+# Timing and allocation tests for each phase of an export, in the manner of pytest-benchmark.
+# Each phase is timed as the best of several runs, and divided by the time of a fixed calibration loop,
+# so that the stored baselines (tests/perf_baseline.json) carry over between machines.
+# A test fails if its phase is slower than the baseline by more than PERF_THRESHOLD (default 0.5, i.e., 50%).
+# Rewrite the baselines with: pytest tests/test_performance.py --update-perf-baseline
+
+import os
+import io
+import time
+import contextlib
+import tracemalloc
+import pytest
+
+import SightingsTOcsv
+from fixturedb import buildDatabase, NOTES
+
+pytestmark = pytest.mark.perf
+
+THRESHOLD = float(os.environ.get('PERF_THRESHOLD','0.5'))
+COPIES = 2000	# Copies of the fixture sightings in the timing database (20000 records)
+REPEAT = 5
+
+def bestTime(function):
+	best = None
+	for i in range(REPEAT):
+		start = time.perf_counter()
+		function()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def calibrationLoop():
+	total = 0
+	for i in range(200000):
+		total += i % 7
+	return total
+
+@pytest.fixture(scope='module')
+def calibration():
+	return bestTime(calibrationLoop)
+
+@pytest.fixture(scope='module')
+def database(tmp_path_factory):
+	return buildDatabase(str(tmp_path_factory.mktemp('perf')),6,COPIES)
+
+def checkBaseline(perfBaseline,key,measured):
+	if perfBaseline['update']:
+		perfBaseline[key] = measured
+		return
+	if key not in perfBaseline:
+		pytest.skip('No stored baseline for ' + key + '; run with --update-perf-baseline')
+	limit = perfBaseline[key] * (1+THRESHOLD)
+	assert measured <= limit, key + ' regressed: ' + str(round(measured,3)) + ' against a baseline of ' + str(round(perfBaseline[key],3))
+
+def options(*arguments):
+	return SightingsTOcsv.parseArguments(list(arguments))
+
+def readMasters(database):
+	for i in range(100):
+		SightingsTOcsv.readMaster(database,{})
+
+def readPlacesAndLinks(database):
+	filespecs = SightingsTOcsv.FileSpecs(database)
+	for i in range(20):
+		places = SightingsTOcsv.readPlaces(database,filespecs,{})
+		for place in places.values():
+			place.linklist
+
+def extractNotes(notes,noteIndex):
+	for i in range(2000):
+		for noteNo in NOTES:
+			SightingsTOcsv.NoteBlock(notes,noteIndex[noteNo]).extract()
+
+def integrateNotes():
+	for i in range(20000):
+		SightingsTOcsv.integrateNote('/B (Yard) Flock of twenty','Trip :: 2019-05-04 Yard\nFlock of twenty feeding\non the lawn.')
+		SightingsTOcsv.integrateNote('Pond','Eight birds on the pond.\nSecond line of the note.')
+
+def runExport(database,outputDir,outputType):
+	with contextlib.redirect_stdout(io.StringIO()):
+		SightingsTOcsv.Export(database,outputDir,SightingsTOcsv.outputTypes[outputType.lower()],options(outputType)).run()
+
+def test_readMaster(database,calibration,perfBaseline):
+	checkBaseline(perfBaseline,'readMaster',bestTime(lambda: readMasters(database)) / calibration)
+
+def test_readPlaces(database,calibration,perfBaseline):
+	checkBaseline(perfBaseline,'readPlaces',bestTime(lambda: readPlacesAndLinks(database)) / calibration)
+
+def test_NoteBlock(database,calibration,perfBaseline):
+	export = SightingsTOcsv.Export(database,'','AviSys',options())
+	checkBaseline(perfBaseline,'NoteBlock',bestTime(lambda: extractNotes(export.notes,export.noteIndex)) / calibration)
+
+def test_integrateNote(calibration,perfBaseline):
+	checkBaseline(perfBaseline,'integrateNote',bestTime(integrateNotes) / calibration)
+
+@pytest.mark.parametrize('outputType',['AviSys','eBird','MyEBird','Report'])
+def test_export(database,tmp_path,calibration,perfBaseline,outputType):
+	checkBaseline(perfBaseline,'export.'+outputType,bestTime(lambda: runExport(database,str(tmp_path),outputType)) / calibration)
+
+def test_export_allocations(database,tmp_path,perfBaseline):
+#	Peak memory and the number of memory blocks still allocated after an export, as counted by tracemalloc.
+#	A first export, not measured, does the one-time work (imports and the like), so the result does not depend on which tests ran before.
+	runExport(database,str(tmp_path),'eBird')
+	tracemalloc.start()
+	try:
+		runExport(database,str(tmp_path),'eBird')
+		(current,peak) = tracemalloc.get_traced_memory()
+		blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+	finally:
+		tracemalloc.stop()
+	checkBaseline(perfBaseline,'allocations.peakBytes',peak)
+	checkBaseline(perfBaseline,'allocations.blocks',blocks)